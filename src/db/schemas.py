@@ -1,15 +1,14 @@
 # src/db/schemas.py
 from pydantic import BaseModel
-from typing import Optional, List
 
 class Conversation(BaseModel):
     """Pydantic model for validating incoming conversation data."""
     message_id: str
     user_id: str
     campaign_id: str
-    timestamp: str 
+    timestamp: str
     intent: str
     message: str
-    
-    # Optional field for the pipeline to add
-    embedding: Optional[List[float]] = None
\ No newline at end of file
+
+    # Note: embeddings live in a separate float32 numpy matrix, not on
+    # the model (a per-record Python list of floats is ~7x larger).
\ No newline at end of file
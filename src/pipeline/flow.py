@@ -1,13 +1,16 @@
 import json
 import logging
+from collections import Counter
+import numpy as np
 import pandas as pd
 from prefect import task, flow
-from sentence_transformers import SentenceTransformer
+from src.utils.embedding import load_embedding_model, encode_texts
 from src.utils.db import (
-    get_mongo_client, 
-    get_milvus_connection, 
+    get_mongo_client,
+    get_milvus_connection,
     get_neo4j_driver,
-    get_sqlite_conn
+    get_sqlite_conn,
+    get_redis_client
 )
 from src.db.schemas import Conversation
 from pydantic import ValidationError
@@ -40,98 +43,155 @@ def extract_raw_data() -> list[dict]:
         return []
 
 @task
-def transform_and_validate(data: list[dict]) -> list[Conversation]:
+def transform_and_validate(data: list[dict]) -> tuple[list[Conversation], np.ndarray]:
     """
     Validates data with Pydantic and generates embeddings.
     Also detects and logs anomalies (e.g., empty embeddings).
+
+    Returns the valid records plus an (N, dim) float32 embedding matrix
+    (row i belongs to record i). Keeping the vectors in one ndarray
+    instead of per-record Python lists is ~7x smaller in memory.
     """
     logger.info(f"Transforming {len(data)} records...")
-    model = SentenceTransformer(config.EMBEDDING_MODEL)
-    
-    valid_data = []
+    model = load_embedding_model()
+
+    # 1. Validate (pass 1)
+    valid_convos = []
+    messages = []
     for item in data:
         try:
-            # 1. Validate
             convo = Conversation(**item)
-            
-            # 2. Generate Embedding             embedding = model.encode(convo.message, convert_to_numpy=True)
-            
-            # Anomaly check
-            if embedding is None or embedding.size == 0:
-                logger.warning(f"Empty embedding for message_id: {convo.message_id}")
-                continue
-                
-            convo.embedding = embedding.tolist()
-            valid_data.append(convo)
-            
+            valid_convos.append(convo)
+            messages.append(convo.message)
         except ValidationError as e:
             logger.warning(f"Invalid data skipped: {item.get('message_id')}. Error: {e}")
-            
-    logger.info(f"Successfully transformed {len(valid_data)} records.")
-    return valid_data
+
+    if not valid_convos:
+        logger.info("Successfully transformed 0 records.")
+        return [], np.empty((0, config.EMBEDDING_DIM), dtype=np.float32)
+
+    # 2. Generate Embeddings (pass 2)
+    # One batched encode call instead of one per message. The model sorts
+    # inputs by length internally, so padding overhead stays low.
+    embeddings = encode_texts(model, messages, batch_size=64)
+
+    # Anomaly check: drop rows with non-finite embeddings
+    finite_rows = np.isfinite(embeddings).all(axis=1)
+    if not finite_rows.all():
+        for convo in (c for c, ok in zip(valid_convos, finite_rows) if not ok):
+            logger.warning(f"Bad embedding for message_id: {convo.message_id}")
+        valid_convos = [c for c, ok in zip(valid_convos, finite_rows) if ok]
+        embeddings = embeddings[finite_rows]
+
+    logger.info(f"Successfully transformed {len(valid_convos)} records.")
+    return valid_convos, embeddings
 
 @task
-def load_to_dbs(data: list[Conversation]):
-    """Loads the transformed data into all four target databases."""
-    logger.info(f"Loading {len(data)} records into databases...")
-    
-    # Get clients
+def load_to_mongo(data: list[Conversation]):
+    """Loads conversation documents into MongoDB."""
     mongo = get_mongo_client()
-    milvus = get_milvus_connection()
-    neo_driver = get_neo4j_driver()
-    sqlite_conn = get_sqlite_conn()
-    
-    # Prepare data for bulk insertion
     # Use model_dump() per Pydantic v2
-    mongo_data = [d.model_dump(exclude={'embedding'}) for d in data] 
-    milvus_data = [
-        [d.message_id for d in data],
-        [d.user_id for d in data],
-        [d.embedding for d in data]
-    ]
+    mongo_data = [d.model_dump() for d in data]
 
-    # --- 1. Load to MongoDB (Document Store)---
     mongo.conversations.delete_many({}) # Clear old data
     mongo.conversations.insert_many(mongo_data)
     logger.info(f"Loaded {len(mongo_data)} records to MongoDB.")
-    
-    # --- 2. Load to Milvus (Vector DB)---
+
+@task
+def load_to_milvus(data: list[Conversation], embeddings: np.ndarray):
+    """Loads embeddings into Milvus."""
     # We clear old data by dropping/re-creating the collection in db.py
-    milvus.insert(milvus_data)
+    milvus = get_milvus_connection()
+    milvus.insert([
+        [d.message_id for d in data],
+        [d.user_id for d in data],
+        embeddings  # pymilvus accepts the float32 matrix directly
+    ])
     milvus.flush() # Ensure data is indexed
-    logger.info(f"Loaded {len(milvus_data[0])} vectors to Milvus.")
-    
-    # --- 3. Load to Neo4j (Graph DB)---
+    logger.info(f"Loaded {len(data)} vectors to Milvus.")
+
+@task
+def load_to_neo4j(data: list[Conversation]):
+    """Loads user/campaign/intent relationships into Neo4j."""
+    neo_driver = get_neo4j_driver()
+    # One UNWIND statement instead of one round trip per record
+    neo4j_rows = [
+        {"user_id": d.user_id, "campaign_id": d.campaign_id, "intent": d.intent, "ts": d.timestamp}
+        for d in data
+    ]
     with neo_driver.session() as session:
         session.run("MATCH (n) DETACH DELETE n") # Clear old data
-        for d in data:
-            # Create nodes and relationships
-            session.run("""
-            MERGE (u:User {id: $user_id})
-            MERGE (c:Campaign {id: $campaign_id})
-            MERGE (i:Intent {name: $intent})
-            MERGE (u)-[:PARTICIPATED_IN {timestamp: $ts}]->(c)
-            MERGE (u)-[:EXPRESSED {timestamp: $ts}]->(i)
-            """, 
-            user_id=d.user_id, 
-            campaign_id=d.campaign_id, 
-            intent=d.intent,
-            ts=d.timestamp
-            )
+        session.execute_write(lambda tx: tx.run("""
+        UNWIND $rows AS r
+        MERGE (u:User {id: r.user_id})
+        MERGE (c:Campaign {id: r.campaign_id})
+        MERGE (i:Intent {name: r.intent})
+        MERGE (u)-[:PARTICIPATED_IN {timestamp: r.ts}]->(c)
+        MERGE (u)-[:EXPRESSED {timestamp: r.ts}]->(i)
+        """, rows=neo4j_rows).consume())
+
+        # Mirror engagement totals onto Campaign nodes so the API can
+        # rank campaigns in the same Cypher query that finds them,
+        # skipping its SQLite hop. Plain SET is fine: the graph was
+        # just rebuilt from scratch above.
+        campaign_rows = [
+            {"campaign_id": cid, "cnt": cnt}
+            for cid, cnt in Counter(d.campaign_id for d in data).items()
+        ]
+        session.execute_write(lambda tx: tx.run("""
+        UNWIND $rows AS r
+        MATCH (c:Campaign {id: r.campaign_id})
+        SET c.engagement = r.cnt
+        """, rows=campaign_rows).consume())
     logger.info(f"Loaded {len(data)} relationships to Neo4j.")
 
-    # --- 4. Load to SQLite (Analytics DB)---
-    df = pd.DataFrame([d.model_dump() for d in data])
-    analytics_df = df.groupby(['user_id', 'campaign_id']).size().reset_index(name='engagement_count')
-    
-    sqlite_conn.execute("DELETE FROM user_analytics") # Clear old data
-    analytics_df.to_sql('user_analytics', sqlite_conn, if_exists='append', index=False)
-    sqlite_conn.commit()
+@task
+def load_to_sqlite(data: list[Conversation]):
+    """Loads engagement aggregates into SQLite."""
+    sqlite_conn = get_sqlite_conn()
+    # A Counter is all the "groupby" we need; no DataFrame required
+    engagement_counts = Counter((d.user_id, d.campaign_id) for d in data)
+    analytics_rows = [(uid, cid, count) for (uid, cid), count in engagement_counts.items()]
+
+    # Single transaction: clear + bulk insert via a prepared statement
+    with sqlite_conn:
+        sqlite_conn.execute("DELETE FROM user_analytics") # Clear old data
+        sqlite_conn.executemany(
+            "INSERT OR REPLACE INTO user_analytics (user_id, campaign_id, engagement_count) VALUES (?, ?, ?)",
+            analytics_rows
+        )
     sqlite_conn.close()
-    logger.info(f"Loaded {len(analytics_df)} aggregates to SQLite.")
+    logger.info(f"Loaded {len(analytics_rows)} aggregates to SQLite.")
+
+@task
+def load_user_vectors_to_redis(data: list[Conversation], embeddings: np.ndarray):
+    """
+    Loads per-user centroid vectors into Redis. The API uses these as
+    ready-made query vectors, so a cache miss no longer needs a Mongo
+    lookup plus a transformer forward pass.
+    """
+    redis_client = get_redis_client()
+    user_ids = sorted({d.user_id for d in data})
+    user_index = {uid: i for i, uid in enumerate(user_ids)}
+    row_index = [user_index[d.user_id] for d in data]
+
+    centroids = np.zeros((len(user_ids), embeddings.shape[1]), dtype=np.float32)
+    np.add.at(centroids, row_index, embeddings)
+    # Re-normalize: a mean of unit vectors isn't unit length, and the
+    # Milvus index expects normalized queries (IP metric)
+    centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+
+    pipe = redis_client.pipeline()
+    for uid, centroid in zip(user_ids, centroids):
+        pipe.set(f"uvec:{uid}", centroid.tobytes())
+    pipe.execute()
+    logger.info(f"Loaded {len(user_ids)} user vectors to Redis.")
 
 # --- Main Flow ---
 
+# Prefect's default task runner (ConcurrentTaskRunner in 2.x,
+# ThreadPoolTaskRunner in 3.x) already executes .submit()'d tasks
+# concurrently, so no explicit runner is configured here.
 @flow(name="Main ETL and Embedding Flow")
 def main_data_pipeline():
     """The main orchestrated workflow."""
@@ -143,12 +203,23 @@ def main_data_pipeline():
         logger.error("No raw data found. Exiting.")
         return
         
-    transformed_data = transform_and_validate(raw_data)
+    transformed_data, embeddings = transform_and_validate(raw_data)
     if not transformed_data:
         logger.error("No data survived transformation. Exiting.")
         return
-        
-    load_to_dbs(transformed_data)
+
+    # The five target stores are independent, so load them concurrently;
+    # the load phase takes max() of the stages instead of their sum
+    logger.info(f"Loading {len(transformed_data)} records into databases...")
+    load_futures = [
+        load_to_mongo.submit(transformed_data),
+        load_to_milvus.submit(transformed_data, embeddings),
+        load_to_neo4j.submit(transformed_data),
+        load_to_sqlite.submit(transformed_data),
+        load_user_vectors_to_redis.submit(transformed_data, embeddings),
+    ]
+    for future in load_futures:
+        future.result()
     
     end_time = pd.Timestamp.now()
     latency = (end_time - start_time).total_seconds()
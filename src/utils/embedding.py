@@ -0,0 +1,93 @@
+# src/utils/embedding.py
+import logging
+import os
+from functools import lru_cache
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from src.utils import config
+
+logger = logging.getLogger(__name__)
+
+_DTYPES = {
+    "float32": torch.float32,
+    "float16": torch.float16,
+    "bfloat16": torch.bfloat16,
+}
+
+def _configure_torch_threads():
+    """
+    Pins torch's CPU thread pools so encode actually uses all cores.
+    The default config often leaves matmuls effectively single-threaded
+    in containers. Override with TORCH_NUM_THREADS.
+    """
+    n = int(os.getenv("TORCH_NUM_THREADS", os.cpu_count() or 4))
+    os.environ.setdefault("OMP_NUM_THREADS", str(n))
+    os.environ.setdefault("MKL_NUM_THREADS", str(n))
+    torch.set_num_threads(n)
+    try:
+        torch.set_num_interop_threads(max(1, n // 4))
+    except RuntimeError:
+        pass  # interop pool already started; can only be set once
+    logger.info(f"Torch CPU threads pinned to {n}.")
+
+def _resolve_dtype():
+    """Picks the inference dtype based on config.EMBEDDING_DTYPE."""
+    choice = config.EMBEDDING_DTYPE
+    if choice == "auto":
+        if torch.cuda.is_available():
+            # bf16 keeps fp32's dynamic range on Ampere+; fall back to fp16
+            if torch.cuda.is_bf16_supported():
+                return torch.bfloat16
+            return torch.float16
+        return torch.float32  # half precision is slow on most CPUs
+    return _DTYPES[choice]
+
+@lru_cache(maxsize=1)
+def load_embedding_model() -> SentenceTransformer:
+    """
+    Loads the configured SentenceTransformer at the configured dtype.
+
+    Cached for the process lifetime: repeated task runs (e.g. Prefect
+    flow retries/reruns in the same worker) would otherwise re-read
+    hundreds of MB of weights from disk each time.
+    """
+    if not torch.cuda.is_available():
+        _configure_torch_threads()
+    if config.EMBEDDING_BACKEND == "onnx":
+        # ONNX Runtime fuses LayerNorm/attention and skips Python-side
+        # overhead, which matters most for the API's batch=1 encodes.
+        # sentence-transformers (>=3.2) exports and caches the ONNX
+        # graph on first load if the hub repo doesn't ship one.
+        logger.info("Loading embedding model with the ONNX Runtime backend.")
+        model = SentenceTransformer(config.EMBEDDING_MODEL, backend="onnx")
+        model.eval()
+        return model
+
+    model = SentenceTransformer(config.EMBEDDING_MODEL)
+    dtype = _resolve_dtype()
+    if dtype is not torch.float32:
+        model = model.to(dtype)
+        logger.info(f"Embedding model loaded in {dtype} (EMBEDDING_DTYPE={config.EMBEDDING_DTYPE}).")
+    model.eval()
+    return model
+
+def encode_texts(model: SentenceTransformer, texts, batch_size: int = 64) -> np.ndarray:
+    """
+    Encodes texts and returns a float32, L2-normalized (N, dim) matrix.
+
+    Normalizing here (once, inside encode) means Milvus inner-product
+    search is cosine similarity and no caller pays for norms at query
+    time. Runs under inference_mode and upcasts the output back to
+    float32, so half-precision models don't leak reduced-precision
+    vectors downstream.
+    """
+    with torch.inference_mode():
+        embeddings = model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+    return embeddings.astype(np.float32, copy=False)
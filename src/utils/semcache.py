@@ -0,0 +1,56 @@
+# src/utils/semcache.py
+import time
+import numpy as np
+
+class SemanticCache:
+    """
+    Small in-process semantic cache: stores (query vector, response)
+    pairs and returns the cached response when a new query vector is
+    within `distance_threshold` cosine distance of a stored one.
+
+    This runs in the API process rather than Redis because the
+    docker-compose Redis (6.2, no RediSearch module) has no vector
+    search. Entries are capped and TTL'd, and with <= max_entries
+    vectors a brute-force cosine scan is microseconds.
+    """
+
+    def __init__(self, distance_threshold: float = 0.15, ttl_seconds: int = 300, max_entries: int = 1024):
+        self.distance_threshold = distance_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._vectors = []   # unit-normalized np.float32 vectors
+        self._responses = [] # (expires_at, response) per vector
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        keep = [i for i, (expires_at, _) in enumerate(self._responses) if expires_at > now]
+        if len(keep) != len(self._responses):
+            self._vectors = [self._vectors[i] for i in keep]
+            self._responses = [self._responses[i] for i in keep]
+
+    def check(self, vector):
+        """Returns the cached response for the nearest stored vector, or None."""
+        self._evict_expired()
+        if not self._vectors:
+            return None
+        query = self._normalize(vector)
+        similarities = np.stack(self._vectors) @ query
+        best = int(np.argmax(similarities))
+        if 1.0 - similarities[best] <= self.distance_threshold:
+            return self._responses[best][1]
+        return None
+
+    def store(self, vector, response):
+        """Caches a response under its query vector."""
+        if len(self._vectors) >= self.max_entries:
+            # Drop the oldest entry
+            self._vectors.pop(0)
+            self._responses.pop(0)
+        self._vectors.append(self._normalize(vector))
+        self._responses.append((time.monotonic() + self.ttl_seconds, response))